@@ -1,33 +1,108 @@
 # app.py
 # python -m uvicorn app:app --reload
+# Sharded mode: N_SHARDS=4 python -m uvicorn app:app
+# Remote shards (sharded_recommender.py --shard ...):
+# SHARD_AUTHKEY=<secret> SHARD_ADDRESSES=host1:6000,host2:6000 python -m uvicorn app:app
 
-from fastapi import FastAPI
+import os
+import atexit
+import threading
+from typing import List, Optional
+
+from fastapi import FastAPI, Query, Body
 import pandas as pd
 from collaborative_recommender import build_user_item_matrix, train_item_similarity_model, recommend_items
-from content_recommender import load_items, build_item_profiles, recommend_for_user
+from content_recommender import load_items, build_content_model, recommend_for_user
+from catalog_onboarding import onboard_products
 from hybrid_recommender import hybrid_recommend
+from item_filters import build_filter_index, filter_mask
+from sharded_recommender import ShardedCatalog, iter_shards, authkey_from_env
 
 # Load data & models at startup
 df_interactions = pd.read_csv("user_interactions.csv")
 df_items = pd.read_csv("products.csv")
+df_users = pd.read_csv("users.csv")
 user_item_matrix = build_user_item_matrix(df_interactions)
-item_similarity_collab = train_item_similarity_model(user_item_matrix)
-item_similarity_content = build_item_profiles(df_items)
+filter_index = build_filter_index(df_items)
+
+N_SHARDS = int(os.environ.get("N_SHARDS", "1"))
+SHARD_ADDRESSES = os.environ.get("SHARD_ADDRESSES")
+
+catalog = None
+if SHARD_ADDRESSES:
+    # Shards already running elsewhere: the front end never builds the similarity matrices
+    catalog = ShardedCatalog([(host, int(port)) for host, port in
+                              (address.rsplit(":", 1) for address in SHARD_ADDRESSES.split(","))],
+                             authkey=authkey_from_env())
+    item_similarity_collab = item_similarity_content = content_model = None
+elif N_SHARDS > 1:
+    # Each shard computes only its own similarity columns; the full matrices are never built here
+    catalog = ShardedCatalog.start_local(
+        iter_shards(N_SHARDS, user_item_matrix, build_content_model(df_items, with_similarity=False), df_items),
+        authkey=authkey_from_env()
+    )
+    item_similarity_collab = item_similarity_content = content_model = None
+else:
+    item_similarity_collab = train_item_similarity_model(user_item_matrix)
+    content_model = build_content_model(df_items)
+    item_similarity_content = content_model["item_similarity"]
+
+scorers = {}
+if catalog is not None:
+    atexit.register(catalog.close)
+    scorers = {"collab_fn": catalog.recommend_items, "content_fn": catalog.recommend_for_user}
 
 app = FastAPI()
 
 @app.get("/recommend/user/{user_id}")
-def recommend_for_user_api(user_id: str, top_k: int = 10):
+def recommend_for_user_api(user_id: str, top_k: int = 10,
+                           brand: Optional[List[str]] = Query(None),
+                           category: Optional[List[str]] = Query(None),
+                           collection: Optional[List[str]] = Query(None),
+                           min_price: Optional[float] = None,
+                           max_price: Optional[float] = None):
+    # e.g. /recommend/user/user_1?brand=Gucci&max_price=1500&collection=Fall/Winter%202025
+    item_filter = filter_mask(filter_index, brand=brand, category=category, collection=collection,
+                              min_price=min_price, max_price=max_price)
     recs = hybrid_recommend(
         user_id, user_item_matrix, item_similarity_collab,
-        df_items, item_similarity_content, df_interactions, df_users=None,
-        top_k=top_k
+        df_items, item_similarity_content, df_interactions, df_users,
+        top_k=top_k, item_filter=item_filter, **scorers
     )
     return {"user_id": user_id, "recommendations": recs.head(top_k).to_dict()}
 
 @app.get("/recommend/item/{item_id}")
 def recommend_similar_item(item_id: str, top_k: int = 5):
-    if item_id not in item_similarity_content.index:
+    if item_id not in filter_index["items"]:
         return {"error": "Item not found"}
-    sims = item_similarity_content[item_id].sort_values(ascending=False).head(top_k+1).drop(item_id)
+    if catalog is not None:
+        sims = catalog.recommend_similar_items(item_id, top_k=top_k)
+    else:
+        sims = item_similarity_content[item_id].sort_values(ascending=False).head(top_k+1).drop(item_id)
     return {"item_id": item_id, "similar_items": sims.to_dict()}
+
+onboarding_lock = threading.Lock()
+
+@app.post("/catalog/items")
+def add_catalog_items(items: List[dict] = Body(...)):
+    # New products become recommendable immediately: no TF-IDF refit, only new-vs-catalog similarities
+    global df_items, item_similarity_content, filter_index
+    if content_model is None:
+        return {"error": "Adding items is not supported in sharded mode"}
+    df_new_items = pd.DataFrame(items)
+    missing = {"image_path", "brand", "category_name", "description", "collection", "price"} - set(df_new_items.columns)
+    if missing:
+        return {"error": f"Missing fields: {sorted(missing)}"}
+    prices = pd.to_numeric(df_new_items["price"], errors="coerce")
+    if prices.isna().any():
+        invalid = df_new_items.loc[prices.isna(), "image_path"].tolist()
+        return {"error": f"Invalid price for items: {invalid}"}
+    df_new_items["price"] = prices
+
+    # one onboarding at a time: content_model, df_items and filter_index must stay aligned
+    with onboarding_lock:
+        n_before = len(df_items)
+        df_items = onboard_products(df_new_items, df_items, content_model)
+        item_similarity_content = content_model["item_similarity"]
+        filter_index = build_filter_index(df_items)
+        return {"added": len(df_items) - n_before, "catalog_size": len(df_items)}
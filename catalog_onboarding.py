@@ -0,0 +1,81 @@
+# catalog_onboarding.py
+# add new products without refitting TF-IDF or recomputing all content similarities
+# Run with: python catalog_onboarding.py new_products.csv
+# (appends to products.csv and embeds only the new images into features.pkl / imagefiles.pkl)
+
+import os
+import argparse
+
+import pandas as pd
+
+from content_recommender import META_COLS, add_items_to_profiles
+
+
+def prepare_new_products(df_new_items, df_items):
+    """
+    Keep only products not yet in the catalog (deduplicated), in the catalog's column layout.
+    Missing attribute flags are 0; missing metadata (description, collection, ...) stays empty.
+    """
+    df_new_items = df_new_items[~df_new_items["image_path"].isin(df_items["image_path"])]
+    df_new_items = df_new_items.drop_duplicates("image_path").reindex(columns=df_items.columns)
+    attr_cols = [col for col in df_items.columns if col not in META_COLS]
+    df_new_items[attr_cols] = df_new_items[attr_cols].fillna(0).astype(df_items[attr_cols].dtypes.to_dict())
+    return df_new_items
+
+
+def onboard_products(df_new_items, df_items, content_model=None, feature_list=None, filenames=None, visual_index=None):
+    """
+    Make new products recommendable without a full rebuild:
+    - content (if content_model given): vectorize against the frozen TF-IDF vocabulary,
+      compute only new-vs-catalog similarities
+    - visual (if feature_list/filenames given): embed only the new images, also into a compressed index
+    Returns the extended df_items; content_model, feature_list, filenames and visual_index are updated in place.
+    """
+    df_new_items = prepare_new_products(df_new_items, df_items)
+    if df_new_items.empty:
+        return df_items
+
+    if content_model is not None:
+        add_items_to_profiles(content_model, df_new_items)
+    df_items = pd.concat([df_items, df_new_items], ignore_index=True)
+
+    if feature_list is not None and filenames is not None:
+        from visual_recommender import add_images_to_index, add_to_compressed_index  # loads ResNet50
+        n_before = len(filenames)
+        add_images_to_index(df_new_items["image_path"].tolist(), feature_list, filenames)
+        if visual_index is not None:
+            add_to_compressed_index(visual_index, feature_list[n_before:], filenames[n_before:])
+
+    return df_items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append new products to the catalog and the visual index.")
+    parser.add_argument("new_products_csv")
+    parser.add_argument("--products", default="products.csv")
+    parser.add_argument("--features", default="features.pkl")
+    parser.add_argument("--paths", default="imagefiles.pkl")
+    parser.add_argument("--compressed-index", default="features_compressed.pkl")
+    args = parser.parse_args()
+
+    from visual_recommender import load_features, save_features, load_compressed_index, save_compressed_index
+
+    df_items = pd.read_csv(args.products)
+    df_new = prepare_new_products(pd.read_csv(args.new_products_csv), df_items)
+    if df_new.empty:
+        print("No new products.")
+        return
+
+    feature_list, filenames = load_features(args.features, args.paths)
+    visual_index = load_compressed_index(args.compressed_index) if os.path.exists(args.compressed_index) else None
+    onboard_products(df_new, df_items, feature_list=feature_list, filenames=filenames, visual_index=visual_index)
+
+    save_features(feature_list, filenames, args.features, args.paths)
+    if visual_index is not None:
+        save_compressed_index(visual_index, args.compressed_index)
+    df_new.to_csv(args.products, mode="a", header=False, index=False)
+    print(f"Appended {len(df_new)} products to {args.products}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,17 @@
 # collaborative_recommender.py
 # user–item interaction matrix + item–item similarity
+# alternative: implicit-feedback matrix factorization (ALS) with memory linear in users + items
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
+from scipy.sparse import csr_matrix
 from sklearn.metrics.pairwise import cosine_similarity
 
+from item_filters import allowed_mask
+
 def load_all_data():
     df_interactions = pd.read_csv("user_interactions.csv")
     return df_interactions
@@ -28,26 +36,169 @@ def train_item_similarity_model(user_item_matrix):
     return sim_df
 
 
-def recommend_items(user_id, user_item_matrix, item_similarity, df_interactions, top_k=50):
+def popular_items(df_interactions, top_k, item_filter=None):
+    """Cold-start fallback: the most interacted items (restricted to item_filter), all scored 1.0."""
+    if df_interactions is None:
+        return pd.Series(dtype=float)
+    counts = df_interactions["image_path"].value_counts()
+    if item_filter is not None:
+        counts = counts[allowed_mask(item_filter, counts.index)]
+    top_items = counts.head(top_k).index.tolist()
+    return pd.Series([1.0]*len(top_items), index=top_items)
+
+
+def recommend_items(user_id, user_item_matrix, item_similarity, df_interactions, top_k=50, item_filter=None):
     # Cold-start: New user
     if user_id not in user_item_matrix.index or user_item_matrix.loc[user_id].sum() == 0:
-        if df_interactions is not None:
-            popular_items = (
-                df_interactions["image_path"]
-                .value_counts()
-                .head(top_k)
-                .index.tolist()
-            )
-            return pd.Series([1.0]*len(popular_items), index=popular_items)
-        else:
-            return pd.Series(dtype=float)
+        return popular_items(df_interactions, top_k, item_filter)
 
     # Normal case
     user_vector = user_item_matrix.loc[user_id]
     scores = user_vector @ item_similarity
     already_seen = user_vector[user_vector > 0].index
     scores = scores.drop(already_seen, errors="ignore")
+    # Filter (item_filters.filter_mask) before top-K, so the whole top_k budget satisfies it
+    if item_filter is not None:
+        scores = scores[allowed_mask(item_filter, scores.index)]
     return scores.sort_values(ascending=False).head(top_k)
 
 
+# --- Implicit-feedback matrix factorization (ALS) ---
+
+def _als_solve_rows(fixed, fixed_gram, interactions, rows, regularization, alpha, batch_size=512):
+    """
+    Solve the implicit ALS normal equations for the given rows of `interactions`:
+    x_u = (YᵀY + Yᵀ(C_u - I)Y + λI)⁻¹ Yᵀ C_u p_u, with confidence C_u = 1 + alpha * r_u.
+    Only the items a row interacted with contribute beyond the shared Gram matrix YᵀY.
+    The systems are stacked per batch and solved with one batched np.linalg.solve,
+    so the heavy work runs in LAPACK without holding the GIL.
+    """
+    factors = fixed.shape[1]
+    base = fixed_gram + regularization * np.eye(factors, dtype=fixed.dtype)
+    solved = np.zeros((len(rows), factors), dtype=fixed.dtype)
+    for start in range(0, len(rows), batch_size):
+        batch = np.asarray(rows[start:start + batch_size])
+        block = interactions[batch]
+        A = np.repeat(base[None], len(batch), axis=0)
+        for n in range(len(batch)):
+            lo, hi = block.indptr[n], block.indptr[n + 1]
+            if lo == hi:
+                continue
+            fixed_rows = fixed[block.indices[lo:hi]]
+            A[n] += (fixed_rows.T * (alpha * block.data[lo:hi])) @ fixed_rows
+        # b_u = Yᵀ C_u p_u for the whole batch as one sparse product
+        weighted = block.copy()
+        weighted.data = 1.0 + alpha * weighted.data
+        b = np.asarray(weighted @ fixed, dtype=fixed.dtype)
+        solved[start:start + len(batch)] = np.linalg.solve(A, b[..., None])[..., 0]
+    return solved
+
+
+def _als_step(fixed, interactions, regularization, alpha, executor, n_threads):
+    fixed_gram = fixed.T @ fixed
+    chunks = np.array_split(np.arange(interactions.shape[0]), n_threads)
+    parts = executor.map(
+        lambda rows: _als_solve_rows(fixed, fixed_gram, interactions, rows, regularization, alpha),
+        chunks
+    )
+    return np.vstack(list(parts))
+
+
+def train_als_model(df_interactions, factors=64, regularization=0.1, alpha=40.0,
+                    iterations=15, n_threads=None, random_state=42):
+    """
+    Train low-rank user and item factors from the weighted interaction_score values
+    (implicit-feedback ALS, Hu/Koren/Volinsky).
+    Memory is linear in users + items: the factors plus the sparse interactions.
+    """
+    interactions = (df_interactions
+                    .groupby(["user_id", "image_path"])["interaction_score"]
+                    .max()
+                    .reset_index())
+    user_index = pd.Index(interactions["user_id"].unique())
+    item_index = pd.Index(interactions["image_path"].unique())
+    user_item = csr_matrix(
+        (interactions["interaction_score"].astype(np.float32),
+         (user_index.get_indexer(interactions["user_id"]),
+          item_index.get_indexer(interactions["image_path"]))),
+        shape=(len(user_index), len(item_index))
+    )
+    item_user = user_item.T.tocsr()
+
+    rng = np.random.default_rng(random_state)
+    user_factors = rng.normal(scale=0.01, size=(len(user_index), factors)).astype(np.float32)
+    item_factors = rng.normal(scale=0.01, size=(len(item_index), factors)).astype(np.float32)
+
+    n_threads = n_threads or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        for _ in range(iterations):
+            user_factors = _als_step(item_factors, user_item, regularization, alpha, executor, n_threads)
+            item_factors = _als_step(user_factors, item_user, regularization, alpha, executor, n_threads)
+
+    return {
+        "user_factors": user_factors,
+        "item_factors": item_factors,
+        "user_index": user_index,
+        "item_index": item_index,
+        "user_item": user_item,
+        "regularization": regularization,
+        "alpha": alpha,
+    }
+
+
+def fold_in_user(item_scores, als_model):
+    """
+    Compute a factor vector for a user that was not part of training, from a
+    Series of interaction scores indexed by image_path. No retraining needed.
+    Returns (user_vector, seen item positions).
+    """
+    item_scores = item_scores.groupby(level=0).max()
+    positions = als_model["item_index"].get_indexer(item_scores.index)
+    known = positions >= 0
+    row = csr_matrix(
+        (item_scores.values[known].astype(np.float32),
+         (np.zeros(known.sum(), dtype=int), positions[known])),
+        shape=(1, len(als_model["item_index"]))
+    )
+    item_factors = als_model["item_factors"]
+    user_vector = _als_solve_rows(item_factors, item_factors.T @ item_factors, row, [0],
+                                  als_model["regularization"], als_model["alpha"])[0]
+    return user_vector, positions[known]
+
+
+def recommend_items_als(user_id, user_item_matrix, als_model, df_interactions, top_k=50, item_filter=None):
+    """
+    Drop-in replacement for recommend_items backed by an ALS model:
+    pass the model in place of the item similarity (e.g. to hybrid_recommend with collab_fn=recommend_items_als).
+    Scoring is a single dot product with the item factors plus a top-K selection.
+    """
+    user_pos = als_model["user_index"].get_indexer([user_id])[0]
+    if user_pos >= 0:
+        user_vector = als_model["user_factors"][user_pos]
+        user_item = als_model["user_item"]
+        seen = user_item.indices[user_item.indptr[user_pos]:user_item.indptr[user_pos + 1]]
+    else:
+        # New user since training: fold in from their interactions, if any
+        if df_interactions is None:
+            return pd.Series(dtype=float)
+        user_rows = df_interactions[df_interactions["user_id"] == user_id]
+        if user_rows.empty or user_rows["interaction_score"].sum() == 0:
+            return popular_items(df_interactions, top_k, item_filter)
+        user_vector, seen = fold_in_user(
+            user_rows.set_index("image_path")["interaction_score"], als_model
+        )
+        if len(seen) == 0:
+            # none of their items is known to the model: nothing to fold in
+            return popular_items(df_interactions, top_k, item_filter)
+
+    scores = als_model["item_factors"] @ user_vector
+    scores[seen] = -np.inf
+    if item_filter is not None:
+        scores[~allowed_mask(item_filter, als_model["item_index"])] = -np.inf
 
+    top_k = min(top_k, int(np.isfinite(scores).sum()))
+    if top_k <= 0:
+        return pd.Series(dtype=float)
+    top = np.argpartition(-scores, top_k - 1)[:top_k]
+    top = top[np.argsort(-scores[top])]
+    return pd.Series(scores[top], index=als_model["item_index"][top])
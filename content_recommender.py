@@ -1,12 +1,19 @@
 # content_recommender.py
 # recommend items that are similar in attributes (category, brand, description, etc.) to items a user liked
 
+import numpy as np
 import pandas as pd
+from scipy.sparse import vstack
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import linear_kernel
 
+from item_filters import allowed_mask
+
 test_sample = 2000  # adjust based on memory and speed requirements
 
+# Known metadata columns; every other product column is a 0/1 attribute flag
+META_COLS = ["image_path", "brand", "category_name", "description", "collection", "price", "text", "attr_text"]
+
 
 def load_items(sample_size, random_state=42):
     """
@@ -25,14 +32,13 @@ def load_items(sample_size, random_state=42):
     return df_items
 
 
-def build_item_profiles(df_items):
+def build_item_text(df_items):
     """
-    Build TF-IDF matrix from product text attributes.
+    Combine product text attributes into the `text` column used for TF-IDF.
     """
 
     # Identify attribute columns (exclude known metadata columns)
-    meta_cols = ["image_path", "brand", "category_name", "description", "collection", "price", "text"]
-    attr_cols = [col for col in df_items.columns if col not in meta_cols]
+    attr_cols = [col for col in df_items.columns if col not in META_COLS]
 
     # For each product, join the names of attributes where value == 1
     df_items["attr_text"] = df_items[attr_cols].apply(
@@ -52,23 +58,98 @@ def build_item_profiles(df_items):
 
     # Basic text cleaning
     df_items["text"] = df_items["text"].str.lower().str.strip()
+    return df_items["text"]
+
+
+def _similarity_frame(buffer, items):
+    """DataFrame view (no copy) of the used top-left corner of the similarity buffer."""
+    n = len(items)
+    return pd.DataFrame(buffer[:n, :n], index=items, columns=items, copy=False)
+
+
+def build_content_model(df_items, with_similarity=True, spare_capacity=0.1, block_size=1024):
+    """
+    Build TF-IDF matrix and item-to-item similarity from product text attributes.
+    The fitted vectorizer and TF-IDF matrix are kept so new items can be added later (add_items_to_profiles).
+    The similarity lives in a buffer with `spare_capacity` extra rows/columns that new items are written into.
+    with_similarity=False skips the n×n similarity (e.g. when shards compute their own column slices).
+    """
+    text = build_item_text(df_items)
 
     # TF-IDF vectorization
     vectorizer = TfidfVectorizer(max_features=10000, stop_words="english") # max_features to limit runtime
-    tfidf_matrix = vectorizer.fit_transform(df_items["text"])
+    tfidf_matrix = vectorizer.fit_transform(text)
 
     # Item-to-item similarity matrix
-    similarity = linear_kernel(tfidf_matrix, tfidf_matrix)
-    sim_df = pd.DataFrame(similarity, index=df_items["image_path"], columns=df_items["image_path"])
+    items = pd.Index(df_items["image_path"])
+    buffer, sim_df = None, None
+    if with_similarity:
+        n = len(items)
+        capacity = n + int(np.ceil(n * spare_capacity))
+        buffer = np.zeros((capacity, capacity), dtype=np.float64)
+        # filled block by block, so no second n×n temporary is allocated
+        for start in range(0, n, block_size):
+            end = min(start + block_size, n)
+            buffer[start:end, :n] = linear_kernel(tfidf_matrix[start:end], tfidf_matrix)
+        sim_df = _similarity_frame(buffer, items)
+
+    return {"vectorizer": vectorizer, "tfidf_matrix": tfidf_matrix, "items": items,
+            "similarity_buffer": buffer, "item_similarity": sim_df}
+
 
-    return sim_df
+def build_item_profiles(df_items):
+    """
+    Build TF-IDF matrix from product text attributes.
+    """
+    # static catalog: no spare capacity for onboarding new items
+    return build_content_model(df_items, spare_capacity=0)["item_similarity"]
 
 
-def recommend_for_user(user_id, df_items, item_similarity, df_interactions, df_users, top_k=50):
+def add_items_to_profiles(content_model, df_new_items):
+    """
+    Add new products to a content model without refitting TF-IDF:
+    new items are vectorized against the frozen vocabulary, and only their similarities
+    to the existing items (and to each other) are computed and written into the spare capacity
+    of the similarity buffer; existing entries are not touched. Items already present are skipped.
+    Returns the updated content model; content_model["item_similarity"] includes the new items.
+    """
+    items = content_model["items"]
+    df_new_items = df_new_items[~df_new_items["image_path"].isin(items)]
+    df_new_items = df_new_items.drop_duplicates("image_path").copy()
+    if df_new_items.empty:
+        return content_model
+
+    new_tfidf = content_model["vectorizer"].transform(build_item_text(df_new_items))
+    cross = linear_kernel(new_tfidf, content_model["tfidf_matrix"])  # new x existing
+    new_new = linear_kernel(new_tfidf, new_tfidf)
+
+    n_old, n_total = len(items), len(items) + len(df_new_items)
+    buffer = content_model["similarity_buffer"]
+    if n_total > buffer.shape[0]:
+        # Out of spare capacity: grow by 25% so the copy is amortized over many onboardings
+        grown = np.zeros((int(n_total * 1.25) + 1,) * 2, dtype=buffer.dtype)
+        grown[:n_old, :n_old] = buffer[:n_old, :n_old]
+        buffer = content_model["similarity_buffer"] = grown
+
+    buffer[n_old:n_total, :n_old] = cross
+    buffer[:n_old, n_old:n_total] = cross.T
+    buffer[n_old:n_total, n_old:n_total] = new_new
+
+    index = items.append(pd.Index(df_new_items["image_path"]))
+    content_model["item_similarity"] = _similarity_frame(buffer, index)
+    content_model["items"] = index
+    content_model["tfidf_matrix"] = vstack([content_model["tfidf_matrix"], new_tfidf]).tocsr()
+    return content_model
+
+
+def recommend_for_user(user_id, df_items, item_similarity, df_interactions, df_users, top_k=50, item_filter=None):
     # Cold-start: new user
     if user_id not in df_interactions["user_id"].unique():
         # recommend popular or random catalog items
-        fallback = df_items.sample(top_k, random_state=42)
+        candidates = df_items
+        if item_filter is not None:
+            candidates = df_items[allowed_mask(item_filter, df_items["image_path"])]
+        fallback = candidates.sample(min(top_k, len(candidates)), random_state=42)
         return pd.Series([1.0]*len(fallback), index=fallback["image_path"])
 
     user_meta = df_users[df_users["user_id"] == user_id].iloc[0].to_dict()
@@ -88,6 +169,8 @@ def recommend_for_user(user_id, df_items, item_similarity, df_interactions, df_u
 
     seen_items = user_items["image_path"].unique()
     scores = scores.drop(seen_items, errors="ignore")
+    if item_filter is not None:
+        scores = scores[allowed_mask(item_filter, scores.index)]
 
     return scores.sort_values(ascending=False).head(top_k)
 
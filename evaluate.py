@@ -0,0 +1,321 @@
+# evaluate.py
+# offline evaluation: time-based train/test split + ranking quality and latency per scorer
+# Run with: python evaluate.py --k 10 --workers 4
+
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from collaborative_recommender import (build_user_item_matrix, train_item_similarity_model, recommend_items,
+                                       train_als_model, recommend_items_als)
+from content_recommender import build_item_profiles, recommend_for_user
+from hybrid_recommender import hybrid_recommend
+from visual_recommender import load_features, load_compressed_index, recommend_similar_vector, search_compressed
+
+
+# --- Train/test split ---
+
+def time_split(df_interactions, test_frac=0.2):
+    """
+    Split interactions at a global timestamp cutoff.
+    The most recent `test_frac` of interactions form the test set, so no model sees the future.
+    """
+    timestamps = pd.to_datetime(df_interactions["timestamp"])
+    cutoff = timestamps.quantile(1 - test_frac)
+    train = df_interactions[timestamps <= cutoff].reset_index(drop=True)
+    test = df_interactions[timestamps > cutoff].reset_index(drop=True)
+    return train, test
+
+
+# --- Metrics ---
+
+def precision_at_k(recommended, relevant, k):
+    if k == 0:
+        return 0.0
+    hits = sum(1 for item in recommended[:k] if item in relevant)
+    return hits / k
+
+
+def recall_at_k(recommended, relevant, k):
+    if not relevant:
+        return 0.0
+    hits = sum(1 for item in recommended[:k] if item in relevant)
+    return hits / len(relevant)
+
+
+def ndcg_at_k(recommended, relevant, k):
+    """Binary-relevance NDCG@k."""
+    dcg = sum(1.0 / np.log2(rank + 2) for rank, item in enumerate(recommended[:k]) if item in relevant)
+    ideal = sum(1.0 / np.log2(rank + 2) for rank in range(min(len(relevant), k)))
+    return dcg / ideal if ideal > 0 else 0.0
+
+
+def intra_list_diversity(recommended, item_similarity):
+    """1 - mean pairwise content similarity of a recommendation list."""
+    items = [item for item in recommended if item in item_similarity.index]
+    if len(items) < 2:
+        return 0.0
+    sims = item_similarity.loc[items, items].values
+    n = len(items)
+    mean_sim = (sims.sum() - np.trace(sims)) / (n * (n - 1))
+    return 1.0 - mean_sim
+
+
+# --- Scorers ---
+# Each scorer returns a ranked list of item ids for one user.
+
+def _score_collab(user_id, ctx, k):
+    recs = recommend_items(user_id, ctx["user_item_matrix"], ctx["item_similarity_collab"],
+                           ctx["df_train"], top_k=k, item_filter=ctx["catalog_filter"])
+    return list(recs.index)
+
+
+def _score_als(user_id, ctx, k):
+    recs = recommend_items_als(user_id, ctx["user_item_matrix"], ctx["als_model"],
+                               ctx["df_train"], top_k=k, item_filter=ctx["catalog_filter"])
+    return list(recs.index)
+
+
+def _score_content(user_id, ctx, k):
+    recs = recommend_for_user(user_id, ctx["df_items"], ctx["item_similarity_content"],
+                              ctx["df_train"], ctx["df_users"], top_k=k)
+    return list(recs.index)
+
+
+def _stored_visual_fn(ctx):
+    """
+    Visual scorer that looks up the stored query vector, so latency measures ranking rather than
+    a ResNet50 forward pass. Searches the compressed index when the context holds one
+    (re-ranked exactly over `rerank` candidates unless rerank is 0), the full-precision features otherwise.
+    """
+    def visual_fn(query_image, top_k=10, item_filter=None):
+        query_vector = ctx["feature_by_path"].get(query_image)
+        if query_vector is None:
+            return []
+        if ctx["visual_index"] is not None:
+            feature_list = ctx["features"] if ctx["rerank"] else None
+            return search_compressed(query_vector, ctx["visual_index"], top_k=top_k, feature_list=feature_list,
+                                     rerank=ctx["rerank"], exclude=query_image, item_filter=item_filter)
+        return recommend_similar_vector(query_vector, ctx["features"], ctx["img_paths"],
+                                        top_k=top_k, exclude=query_image, item_filter=item_filter)
+    return visual_fn
+
+
+def _score_visual(user_id, ctx, k):
+    query_image = ctx["last_item"].get(user_id)
+    seen = ctx["seen_items"].get(user_id, set())
+    # over-fetch so that already seen items can be dropped
+    recs = _stored_visual_fn(ctx)(query_image, top_k=k + len(seen))
+    return [img for img, _ in recs if img not in seen][:k]
+
+
+def _score_hybrid(user_id, ctx, k):
+    visual_fn, query_image = None, None
+    if ctx["features"] is not None:
+        visual_fn, query_image = _stored_visual_fn(ctx), ctx["last_item"].get(user_id)
+    recs = hybrid_recommend(
+        user_id, ctx["user_item_matrix"], ctx["item_similarity_collab"],
+        ctx["df_items"], ctx["item_similarity_content"], ctx["df_train"], ctx["df_users"],
+        query_image=query_image, visual_fn=visual_fn,
+        top_k=k, **ctx["hybrid_kwargs"]
+    )
+    return list(recs.index)
+
+
+SCORERS = {
+    "collab": _score_collab,
+    "als": _score_als,
+    "content": _score_content,
+    "visual": _score_visual,
+    "hybrid": _score_hybrid,
+}
+
+
+# --- Worker side ---
+
+_CONTEXT = None
+
+
+def _init_worker(ctx):
+    """Process pool initializer: receive the trained models once per worker."""
+    global _CONTEXT
+    _CONTEXT = ctx
+
+
+def _evaluate_user(user_id):
+    ctx = _CONTEXT
+    k = ctx["k"]
+    relevant = ctx["relevant"][user_id]
+    rows = []
+    for name in ctx["scorers"]:
+        start = time.perf_counter()
+        recommended = SCORERS[name](user_id, ctx, k)
+        latency_ms = (time.perf_counter() - start) * 1000
+        rows.append({
+            "user_id": user_id,
+            "scorer": name,
+            "precision": precision_at_k(recommended, relevant, k),
+            "recall": recall_at_k(recommended, relevant, k),
+            "ndcg": ndcg_at_k(recommended, relevant, k),
+            "diversity": intra_list_diversity(recommended, ctx["item_similarity_content"]),
+            "latency_ms": latency_ms,
+            "items": recommended[:k],
+        })
+    return rows
+
+
+# --- Driver ---
+
+def build_context(df_train, df_test, df_items, df_users, features=None, img_paths=None,
+                  k=10, scorers=None, hybrid_kwargs=None, visual_index=None, rerank=100):
+    """
+    Train all models on the train split and collect everything the workers need.
+    visual_index: optional compressed index (built from the same features), used by the visual and hybrid scorers.
+    """
+    if scorers is None:
+        scorers = [name for name in SCORERS if name != "visual" or features is not None]
+
+    user_item_matrix = build_user_item_matrix(df_train)
+    # the dense item-item model is only needed by the collab and hybrid scorers
+    item_similarity_collab = None
+    if "collab" in scorers or "hybrid" in scorers:
+        item_similarity_collab = train_item_similarity_model(user_item_matrix)
+    item_similarity_content = build_item_profiles(df_items)
+    als_model = train_als_model(df_train) if "als" in scorers else None
+
+    # Collab/ALS are trained on every interacted item, but only catalog items can be recommended
+    # by content/visual. Restrict all scorers and the relevant sets to the catalog, so they compare fairly.
+    catalog = set(df_items["image_path"])
+    catalog_filter = pd.Series(True, index=pd.Index(sorted(catalog)))
+    df_test = df_test[df_test["image_path"].isin(catalog)]
+    train_users = set(df_train["user_id"])
+    relevant = {
+        user: set(group["image_path"])
+        for user, group in df_test.groupby("user_id")
+        if user in train_users
+    }
+
+    last_item = (df_train.sort_values("timestamp")
+                 .groupby("user_id")["image_path"].last().to_dict())
+    seen_items = df_train.groupby("user_id")["image_path"].agg(set).to_dict()
+    feature_by_path = dict(zip(img_paths, features)) if features is not None else {}
+
+    return {
+        "k": k,
+        "scorers": scorers,
+        "df_train": df_train,
+        "df_items": df_items,
+        "df_users": df_users,
+        "user_item_matrix": user_item_matrix,
+        "item_similarity_collab": item_similarity_collab,
+        "item_similarity_content": item_similarity_content,
+        "als_model": als_model,
+        "features": features,
+        "img_paths": img_paths,
+        "feature_by_path": feature_by_path,
+        "visual_index": visual_index,
+        "rerank": rerank,
+        "last_item": last_item,
+        "seen_items": seen_items,
+        "relevant": relevant,
+        "catalog_filter": catalog_filter,
+        "hybrid_kwargs": hybrid_kwargs or {},
+    }
+
+
+def summarize(per_user, catalog):
+    """Aggregate per-user rows into one quality/latency line per scorer."""
+    rows = []
+    for name, group in per_user.groupby("scorer", sort=False):
+        recommended = set(item for items in group["items"] for item in items) & catalog
+        rows.append({
+            "scorer": name,
+            "users": len(group),
+            "precision@k": group["precision"].mean(),
+            "recall@k": group["recall"].mean(),
+            "ndcg@k": group["ndcg"].mean(),
+            "coverage": len(recommended) / len(catalog) if catalog else 0.0,
+            "diversity": group["diversity"].mean(),
+            "latency_mean_ms": group["latency_ms"].mean(),
+            "latency_p50_ms": group["latency_ms"].quantile(0.5),
+            "latency_p95_ms": group["latency_ms"].quantile(0.95),
+        })
+    return pd.DataFrame(rows).set_index("scorer")
+
+
+def evaluate(df_interactions, df_items, df_users, features=None, img_paths=None,
+             k=10, test_frac=0.2, workers=None, max_users=None, scorers=None, hybrid_kwargs=None,
+             visual_index=None, rerank=100):
+    """
+    Run the offline evaluation and return (per_user, summary) DataFrames.
+    - workers: number of processes (None -> os.cpu_count(), 1 -> run in-process).
+    - max_users: evaluate only the first N eligible users (for quick checks).
+    - hybrid_kwargs: extra arguments for hybrid_recommend, e.g. diversify/lambda_param.
+    - visual_index/rerank: evaluate visual search on a compressed index instead of the full-precision features.
+    """
+    df_train, df_test = time_split(df_interactions, test_frac=test_frac)
+    ctx = build_context(df_train, df_test, df_items, df_users, features, img_paths,
+                        k=k, scorers=scorers, hybrid_kwargs=hybrid_kwargs,
+                        visual_index=visual_index, rerank=rerank)
+
+    users = sorted(ctx["relevant"])
+    if max_users:
+        users = users[:max_users]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init_worker(ctx)
+        results = [_evaluate_user(user) for user in users]
+    else:
+        chunksize = max(1, len(users) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(ctx,)) as pool:
+            results = list(pool.map(_evaluate_user, users, chunksize=chunksize))
+
+    per_user = pd.DataFrame([row for rows in results for row in rows])
+    summary = summarize(per_user, set(df_items["image_path"]))
+    return per_user, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline evaluation of the fashion recommenders.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--test-frac", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-users", type=int, default=None)
+    parser.add_argument("--scorers", nargs="+", choices=list(SCORERS), default=None)
+    parser.add_argument("--visual", action="store_true", help="load features.pkl for the visual scorer")
+    parser.add_argument("--compressed", action="store_true",
+                        help="search features_compressed.pkl in the visual/hybrid scorers (implies --visual)")
+    parser.add_argument("--rerank", type=int, default=100,
+                        help="exact re-ranking candidates for --compressed (0 = compressed scores only)")
+    parser.add_argument("--diversify", action="store_true", help="apply MMR in the hybrid scorer")
+    parser.add_argument("--lambda-param", type=float, default=0.7)
+    parser.add_argument("--output", default=None, help="optional CSV path for per-user results")
+    args = parser.parse_args()
+
+    df_interactions = pd.read_csv("user_interactions.csv")
+    df_items = pd.read_csv("products.csv")
+    df_users = pd.read_csv("users.csv")
+    features, img_paths = load_features() if args.visual or args.compressed else (None, None)
+    visual_index = load_compressed_index() if args.compressed else None
+
+    per_user, summary = evaluate(
+        df_interactions, df_items, df_users, features, img_paths,
+        k=args.k, test_frac=args.test_frac, workers=args.workers,
+        max_users=args.max_users, scorers=args.scorers,
+        hybrid_kwargs={"diversify": args.diversify, "lambda_param": args.lambda_param},
+        visual_index=visual_index, rerank=args.rerank
+    )
+
+    print(summary.to_string(float_format=lambda x: f"{x:.4f}"))
+    if args.output:
+        per_user.drop(columns="items").to_csv(args.output, index=False)
+        print(f"Saved per-user results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,8 @@ from sklearn.preprocessing import MinMaxScaler
 
 from collaborative_recommender import build_user_item_matrix, train_item_similarity_model, recommend_items
 from content_recommender import load_items, build_item_profiles, recommend_for_user
-from visual_recommender import load_features, recommend_similar_images
+from item_filters import allowed_mask
+from visual_recommender import load_features, recommend_similar_images, recommend_similar_images_compressed
 
 
 # --- Utility functions ---
@@ -53,37 +54,55 @@ def diversify_mmr(item_scores, item_similarity, top_k=10, lambda_param=0.7):
 def hybrid_recommend(user_id, user_item_matrix, item_similarity_collab,
                      df_items, item_similarity_content, df_interactions, df_users,
                      features=None, img_paths=None,
-                     query_image=None,
+                     query_image=None, visual_index=None,
                      alpha=None, beta=None, gamma=None,
-                     top_k=50, diversify=False, lambda_param=0.7):
+                     top_k=50, diversify=False, lambda_param=0.7,
+                     collab_fn=recommend_items, content_fn=recommend_for_user, visual_fn=None,
+                     item_filter=None):
     """
     Combine collaborative, content-based, and visual recommendations.
     - features/img_paths: precomputed ResNet embeddings (for visual recommender).
     - query_image: path of image used as a visual query.
+    - visual_index: optional compressed index (build_compressed_index); if features are given too, its candidates are re-ranked exactly.
     - alpha, beta, gamma: weights (if None, adaptive with defaults).
+    - collab_fn: collaborative scorer, e.g. recommend_items_als with an ALS model passed as item_similarity_collab.
+    - content_fn / visual_fn: replacement content and visual scorers, e.g. the ShardedCatalog methods.
+    - item_filter: boolean Series from item_filters.filter_mask; applied inside every scorer before top-K.
     """
 
     # --- Collaborative ---
     try:
-        collab_scores = recommend_items(
+        collab_scores = collab_fn(
             user_id, user_item_matrix, item_similarity_collab,
-            df_interactions, top_k=top_k*5
+            df_interactions, top_k=top_k*5, item_filter=item_filter
         )
     except KeyError:
         collab_scores = pd.Series(dtype=float)
 
     # --- Content ---
     try:
-        content_scores = recommend_for_user(
+        content_scores = content_fn(
             user_id, df_items, item_similarity_content,
-            df_interactions, df_users, top_k=top_k*5
+            df_interactions, df_users, top_k=top_k*5, item_filter=item_filter
         )
     except ValueError:
         content_scores = pd.Series(dtype=float)
 
     # --- Visual (only if query_image given) ---
-    if features is not None and img_paths is not None and query_image:
-        visual_raw = recommend_similar_images(query_image, features, img_paths, top_k=top_k*5)
+    if visual_fn is not None and query_image:
+        visual_raw = visual_fn(query_image, top_k=top_k*5, item_filter=item_filter)
+        visual_scores = pd.Series(
+            {img: score for img, score in visual_raw}, dtype=float
+        )
+    elif visual_index is not None and query_image:
+        visual_raw = recommend_similar_images_compressed(query_image, visual_index, top_k=top_k*5,
+                                                         feature_list=features, item_filter=item_filter)
+        visual_scores = pd.Series(
+            {img: score for img, score in visual_raw}, dtype=float
+        )
+    elif features is not None and img_paths is not None and query_image:
+        visual_raw = recommend_similar_images(query_image, features, img_paths, top_k=top_k*5,
+                                              item_filter=item_filter)
         visual_scores = pd.Series(
             {img: score for img, score in visual_raw}, dtype=float
         )
@@ -128,9 +147,10 @@ def hybrid_recommend(user_id, user_item_matrix, item_similarity_collab,
     # Fallback
     if len(final_scores) < top_k:
         missing = top_k - len(final_scores)
-        popular_items = (df_interactions["item_id"]
-                         .value_counts()
-                         .index.difference(final_scores.index))[:missing]
+        popular = df_interactions["image_path"].value_counts().index
+        if item_filter is not None:
+            popular = popular[allowed_mask(item_filter, popular)]
+        popular_items = popular.difference(final_scores.index)[:missing]
         popular_scores = pd.Series([0.01]*len(popular_items), index=popular_items)
         final_scores = pd.concat([final_scores, popular_scores])
 
@@ -0,0 +1,79 @@
+# item_filters.py
+# precomputed attribute bitmaps + sorted price index for filtered retrieval
+# (e.g. "only Gucci", "under 1500 €", "Fall/Winter 2025 only")
+
+import numpy as np
+import pandas as pd
+
+FILTER_COLUMNS = {
+    "brand": "brand",
+    "category": "category_name",
+    "collection": "collection",
+}
+
+
+def build_filter_index(df_items):
+    """
+    Build once from df_items:
+    - one boolean bitmap per value of brand, category_name and collection
+    - the prices sorted ascending, with the catalog positions in that order
+    """
+    items = pd.Index(df_items["image_path"])
+    bitmaps = {}
+    for name, column in FILTER_COLUMNS.items():
+        codes, values = pd.factorize(df_items[column])
+        bitmaps[name] = {value: codes == code for code, value in enumerate(values)}
+
+    prices = pd.to_numeric(df_items["price"], errors="coerce").to_numpy(dtype=float)
+    price_order = np.argsort(prices, kind="stable")
+    n_valid = int((~np.isnan(prices)).sum())  # NaN prices sort last and never match a price range
+
+    return {
+        "items": items,
+        "bitmaps": bitmaps,
+        "price_order": price_order[:n_valid],
+        "price_sorted": prices[price_order[:n_valid]],
+    }
+
+
+def _value_mask(bitmaps, values, n_items):
+    if isinstance(values, str):
+        values = [values]
+    mask = np.zeros(n_items, dtype=bool)
+    for value in values:
+        if value in bitmaps:
+            mask |= bitmaps[value]
+    return mask
+
+
+def filter_mask(filter_index, brand=None, category=None, collection=None,
+                min_price=None, max_price=None):
+    """
+    Combine the requested predicates into one boolean Series indexed by image_path.
+    brand/category/collection accept a single value or a list of values (OR within a field, AND across fields).
+    Returns None when no predicate is given, so callers can skip filtering entirely.
+    """
+    predicates = {"brand": brand, "category": category, "collection": collection}
+    if all(v is None for v in predicates.values()) and min_price is None and max_price is None:
+        return None
+
+    n_items = len(filter_index["items"])
+    mask = np.ones(n_items, dtype=bool)
+    for name, values in predicates.items():
+        if values is not None:
+            mask &= _value_mask(filter_index["bitmaps"][name], values, n_items)
+
+    if min_price is not None or max_price is not None:
+        price_sorted = filter_index["price_sorted"]
+        lo = 0 if min_price is None else np.searchsorted(price_sorted, min_price, side="left")
+        hi = len(price_sorted) if max_price is None else np.searchsorted(price_sorted, max_price, side="right")
+        price_mask = np.zeros(n_items, dtype=bool)
+        price_mask[filter_index["price_order"][lo:hi]] = True
+        mask &= price_mask
+
+    return pd.Series(mask, index=filter_index["items"])
+
+
+def allowed_mask(item_filter, items):
+    """Align an item filter to an arbitrary list of items (unknown items are not allowed)."""
+    return item_filter.reindex(items, fill_value=False).to_numpy(dtype=bool)
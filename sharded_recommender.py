@@ -0,0 +1,374 @@
+# sharded_recommender.py
+# catalog-sharded scatter-gather serving
+# Each shard worker holds only its slice of the similarity columns and visual embeddings;
+# the front end scatters a request to all shards and merges their partial top-K lists with a heap.
+#
+# Remote shard (stand-in for another node); the connection unpickles requests, so a secret key is required:
+# SHARD_AUTHKEY=<secret> python sharded_recommender.py --shard shard_0.pkl --host 0.0.0.0 --port 6000
+
+import os
+import heapq
+import pickle
+import argparse
+import itertools
+import threading
+import zlib
+import multiprocessing as mp
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from sklearn.metrics.pairwise import cosine_similarity, linear_kernel
+
+from collaborative_recommender import popular_items
+from item_filters import allowed_mask
+
+
+def authkey_from_env():
+    """Shared secret for shard connections, from the SHARD_AUTHKEY environment variable (None if unset)."""
+    key = os.environ.get("SHARD_AUTHKEY")
+    return key.encode("utf-8") if key else None
+
+
+# --- Building shards ---
+
+def shard_of(item, n_shards):
+    """Stable shard assignment for an image_path (same on every process and node)."""
+    return zlib.crc32(str(item).encode("utf-8")) % n_shards
+
+
+def _owned(items, n_shards, shard_id):
+    return [i for i, item in enumerate(items) if shard_of(item, n_shards) == shard_id]
+
+
+def _slice(row_items, owned, matrix):
+    """Similarities of all items (rows) to the items owned by this shard (columns), as float32."""
+    columns = [row_items[i] for i in owned]
+    return {
+        "rows": {item: i for i, item in enumerate(row_items)},
+        "items": columns,
+        "positions": {item: i for i, item in enumerate(columns)},
+        "matrix": np.asarray(matrix, dtype=np.float32),
+    }
+
+
+def iter_shards(n_shards, user_item_matrix=None, content_model=None,
+                df_items=None, features=None, img_paths=None):
+    """
+    Yield the n_shards slices one at a time. Each shard's similarity columns are computed directly
+    from the interactions (cosine) and the TF-IDF matrix (linear kernel), so the full n×n matrices
+    never exist in one process and at most one slice is alive while iterating.
+    """
+    if user_item_matrix is not None:
+        collab_items = list(user_item_matrix.columns)
+        interactions = csr_matrix(user_item_matrix.to_numpy(dtype=np.float32)).T.tocsr()  # items x users
+    if content_model is not None:
+        content_items = list(content_model["items"])
+        tfidf_matrix = content_model["tfidf_matrix"]
+
+    for shard_id in range(n_shards):
+        shard = {
+            "shard_id": shard_id,
+            "n_shards": n_shards,
+            "collab": None,
+            "content": None,
+            "descriptions": None,
+            "visual": None,
+        }
+        if user_item_matrix is not None:
+            owned = _owned(collab_items, n_shards, shard_id)
+            shard["collab"] = _slice(collab_items, owned, cosine_similarity(interactions, interactions[owned]))
+        if content_model is not None:
+            owned = _owned(content_items, n_shards, shard_id)
+            shard["content"] = _slice(content_items, owned, linear_kernel(tfidf_matrix, tfidf_matrix[owned]))
+            if df_items is not None:
+                descriptions = df_items.drop_duplicates("image_path").set_index("image_path")["description"]
+                shard["descriptions"] = descriptions.reindex(shard["content"]["items"]).fillna("").tolist()
+        if features is not None and img_paths is not None:
+            owned = _owned(img_paths, n_shards, shard_id)
+            shard["visual"] = {
+                "items": [img_paths[i] for i in owned],
+                "positions": {img_paths[i]: n for n, i in enumerate(owned)},
+                "matrix": np.asarray([features[i] for i in owned], dtype=np.float32).reshape(len(owned), -1),
+            }
+        yield shard
+
+
+def build_shards(n_shards, user_item_matrix=None, content_model=None,
+                 df_items=None, features=None, img_paths=None):
+    """All shards as a list (e.g. for save_shards); prefer iter_shards when starting workers."""
+    return list(iter_shards(n_shards, user_item_matrix, content_model, df_items, features, img_paths))
+
+
+def save_shards(shards, prefix="shard"):
+    for shard in shards:
+        path = f"{prefix}_{shard['shard_id']}.pkl"
+        pickle.dump(shard, open(path, "wb"))
+        print(f"Saved shard {shard['shard_id']}/{shard['n_shards']} to {path}")
+
+
+# --- Shard side ---
+
+def _top_k(scores, index, top_k, exclude=None, allowed=None):
+    """Partial top-K of one shard as a list of (score, item), best first."""
+    items, positions = index["items"], index["positions"]
+    if exclude:
+        scores[[positions[item] for item in exclude if item in positions]] = -np.inf
+    if allowed is not None:
+        scores[~allowed] = -np.inf
+    top_k = min(top_k, int(np.isfinite(scores).sum()))
+    if top_k <= 0:
+        return []
+    top = np.argpartition(-scores, top_k - 1)[:top_k]
+    top = top[np.argsort(-scores[top])]
+    return [(float(scores[i]), items[i]) for i in top]
+
+
+def _weighted_rows(sim, weighted_items):
+    """Sum of similarity rows of the given items, each scaled by its weight."""
+    scores = np.zeros(len(sim["items"]), dtype=np.float32)
+    for item, weight in weighted_items:
+        row = sim["rows"].get(item)
+        if row is not None:
+            scores += weight * sim["matrix"][row]
+    return scores
+
+
+def _shard_collab(shard, user_items, top_k, exclude, allowed=None):
+    sim = shard["collab"]
+    return _top_k(_weighted_rows(sim, user_items), sim, top_k, exclude, allowed)
+
+
+def _shard_content(shard, recent_items, top_k, exclude, style_pref=None, allowed=None):
+    sim = shard["content"]
+    scores = _weighted_rows(sim, recent_items)
+    if style_pref:
+        style_masks = shard.setdefault("style_masks", {})  # only a handful of style preferences exist
+        if style_pref not in style_masks:
+            style_masks[style_pref] = (pd.Series(shard["descriptions"], dtype=object)
+                                       .str.contains(style_pref, case=False, na=False).to_numpy(dtype=bool))
+        scores[style_masks[style_pref]] *= 1.2
+    return _top_k(scores, sim, top_k, exclude, allowed)
+
+
+def _shard_visual(shard, query_vector, top_k, exclude, allowed=None):
+    visual = shard["visual"]
+    scores = visual["matrix"] @ np.asarray(query_vector, dtype=np.float32)
+    return _top_k(scores, visual, top_k, exclude, allowed)
+
+
+def _shard_items(shard):
+    return {kind: shard[kind]["items"] if shard[kind] is not None else [] for kind in ("collab", "content", "visual")}
+
+
+SHARD_METHODS = {
+    "items": _shard_items,
+    "collab": _shard_collab,
+    "content": _shard_content,
+    "visual": _shard_visual,
+}
+
+
+def _serve_connection(shard, conn):
+    """Answer (method, kwargs) requests on one client connection until it closes."""
+    with conn:
+        while True:
+            try:
+                method, kwargs = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                result = SHARD_METHODS[method](shard, **kwargs)
+            except Exception as e:
+                result = e
+            try:
+                conn.send(result)
+            except (EOFError, OSError):
+                return
+
+
+def serve_shard(shard, address, authkey, ready=None):
+    """
+    Serve one shard over multiprocessing connections (the local RPC stand-in),
+    one thread per connected front end. Requests are (method, kwargs) tuples.
+    Connections unpickle what they receive, so an authkey is required on every address, local ones included.
+    """
+    if not authkey:
+        raise ValueError("Refusing to serve a shard without an authkey (set SHARD_AUTHKEY).")
+    with Listener(address, authkey=authkey) as listener:
+        if ready is not None:
+            ready.send(listener.address)
+            ready.close()
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError, OSError):
+                continue  # failed handshake of one client; keep serving the others
+            threading.Thread(target=_serve_connection, args=(shard, conn), daemon=True).start()
+
+
+def _local_worker(ready, authkey):
+    """Worker process entry point: the shard arrives over the pipe, so the parent can drop it right away."""
+    shard = ready.recv()
+    serve_shard(shard, ("localhost", 0), authkey, ready)
+
+
+# --- Front end ---
+
+class ShardedCatalog:
+    """
+    Scatter-gather client over N shard workers.
+    Its recommend_items / recommend_for_user methods keep the signatures of the single-process
+    scorers, so they plug into hybrid_recommend via collab_fn / content_fn.
+    """
+
+    def __init__(self, addresses, authkey=None, processes=None):
+        self.connections = [Client(tuple(address), authkey=authkey) for address in addresses]
+        self.processes = processes or []
+        # one request round (send to all shards, read all replies) at a time per connection set
+        self.lock = threading.Lock()
+        # item lists per shard, used to slice item filters into per-shard masks
+        items = self._call_all("items", {})
+        self.shard_items = {kind: [shard_items[kind] for shard_items in items]
+                            for kind in ("collab", "content", "visual")}
+
+    @classmethod
+    def start_local(cls, shards, authkey=None):
+        """
+        Start one local worker process per shard and connect to them.
+        `shards` may be a generator (iter_shards): each shard is handed to its worker and dropped
+        before the next one is built. Without an authkey a random one is generated for the workers.
+        """
+        authkey = authkey or os.urandom(32)
+        ctx = mp.get_context()
+        processes, addresses = [], []
+        for shard in shards:
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=_local_worker, args=(child_conn, authkey), daemon=True)
+            process.start()
+            child_conn.close()
+            parent_conn.send(shard)
+            del shard
+            addresses.append(parent_conn.recv())
+            parent_conn.close()
+            processes.append(process)
+        return cls(addresses, authkey=authkey, processes=processes)
+
+    def close(self):
+        """Disconnect; shard workers started by this front end (start_local) are stopped as well."""
+        for conn in self.connections:
+            try:
+                conn.close()
+            except OSError:
+                pass
+        for process in self.processes:
+            process.terminate()
+            process.join(timeout=5)
+        self.connections, self.processes = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _allowed(self, kind, item_filter):
+        if item_filter is None:
+            return [None] * len(self.connections)
+        return [allowed_mask(item_filter, items) for items in self.shard_items[kind]]
+
+    def _call_all(self, method, kwargs, per_shard=None):
+        """
+        Send first to every shard so they work in parallel, then collect the replies in order.
+        The whole round holds the lock, and every reply is read before an error is raised,
+        so no reply is left queued for the next caller.
+        """
+        per_shard = per_shard or [{}] * len(self.connections)
+        with self.lock:
+            for conn, extra in zip(self.connections, per_shard):
+                conn.send((method, dict(kwargs, **extra)))
+            results = [conn.recv() for conn in self.connections]
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def scatter_gather(self, method, top_k, allowed=None, **kwargs):
+        """Send the request to every shard, then merge their partial top-K lists with a heap."""
+        allowed = allowed or [None] * len(self.connections)
+        partials = self._call_all(method, dict(kwargs, top_k=top_k),
+                                  per_shard=[{"allowed": shard_allowed} for shard_allowed in allowed])
+        merged = heapq.merge(*partials, key=lambda x: x[0], reverse=True)
+        top = list(itertools.islice(merged, top_k))
+        return pd.Series([score for score, _ in top], index=[item for _, item in top], dtype=float)
+
+    def recommend_items(self, user_id, user_item_matrix, item_similarity=None, df_interactions=None,
+                        top_k=50, item_filter=None):
+        """Sharded collaborative_recommender.recommend_items (item_similarity is held by the shards)."""
+        if user_id not in user_item_matrix.index or user_item_matrix.loc[user_id].sum() == 0:
+            return popular_items(df_interactions, top_k, item_filter)
+        user_vector = user_item_matrix.loc[user_id]
+        user_vector = user_vector[user_vector > 0]
+        return self.scatter_gather(
+            "collab", top_k, allowed=self._allowed("collab", item_filter),
+            user_items=list(user_vector.items()), exclude=set(user_vector.index)
+        )
+
+    def recommend_for_user(self, user_id, df_items, item_similarity=None, df_interactions=None, df_users=None,
+                           top_k=50, item_filter=None):
+        """Sharded content_recommender.recommend_for_user (item_similarity is held by the shards)."""
+        if user_id not in df_interactions["user_id"].unique():
+            candidates = df_items
+            if item_filter is not None:
+                candidates = df_items[allowed_mask(item_filter, df_items["image_path"])]
+            fallback = candidates.sample(min(top_k, len(candidates)), random_state=42)
+            return pd.Series([1.0]*len(fallback), index=fallback["image_path"])
+
+        style_pref = df_users[df_users["user_id"] == user_id].iloc[0]["style_pref"]
+        user_items = df_interactions[df_interactions["user_id"] == user_id].sort_values("timestamp", ascending=False)
+        recent_items = user_items["image_path"].head(5).tolist()
+        return self.scatter_gather(
+            "content", top_k, allowed=self._allowed("content", item_filter),
+            recent_items=[(item, 1.0 / (rank + 1)) for rank, item in enumerate(recent_items)],
+            exclude=set(user_items["image_path"]), style_pref=style_pref
+        )
+
+    def recommend_similar_items(self, item_id, item_similarity=None, top_k=10):
+        """Sharded content_recommender.recommend_similar_items."""
+        return self.scatter_gather("content", top_k, recent_items=[(item_id, 1.0)], exclude={item_id})
+
+    def recommend_similar_vector(self, query_vector, top_k=10, exclude=None, item_filter=None):
+        """Sharded visual search for an already extracted query embedding, as a list of (image, score)."""
+        scores = self.scatter_gather(
+            "visual", top_k, allowed=self._allowed("visual", item_filter),
+            query_vector=query_vector, exclude={exclude} if exclude else None
+        )
+        return list(scores.items())
+
+    def recommend_similar_images(self, query_img_path, top_k=10, item_filter=None):
+        """Sharded visual_recommender.recommend_similar_images (usable as hybrid_recommend's visual_fn)."""
+        from visual_recommender import extract_feature  # loads ResNet50 only when visual search is used
+        return self.recommend_similar_vector(extract_feature(query_img_path), top_k=top_k,
+                                             exclude=query_img_path, item_filter=item_filter)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve one catalog shard.")
+    parser.add_argument("--shard", required=True, help="pickle written by save_shards")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6000)
+    args = parser.parse_args()
+
+    # read from the environment only: a key on the command line would be visible in ps
+    authkey = authkey_from_env()
+    if authkey is None:
+        parser.error("set the shared secret in the SHARD_AUTHKEY environment variable")
+
+    shard = pickle.load(open(args.shard, "rb"))
+    print(f"Serving shard {shard['shard_id']}/{shard['n_shards']} on {args.host}:{args.port}")
+    serve_shard(shard, (args.host, args.port), authkey)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,19 @@
 # visual_recommender.py
 import os
+import time
 import pickle
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
+from sklearn.decomposition import PCA
 from numpy.linalg import norm
 from tensorflow.keras.preprocessing import image
 from tensorflow.keras.applications.resnet50 import ResNet50, preprocess_input
 from keras.layers import GlobalMaxPooling2D
 import tensorflow as tf
 
+from item_filters import allowed_mask
+
 
 # Run a one-time indexing (this builds features.pkl + imagefiles.pkl):
 # python -c "from visual_recommender import build_feature_index_from_catalog; build_feature_index_from_catalog('products.csv')"
@@ -65,6 +69,29 @@ def build_feature_index_from_catalog(products_csv="products.csv", features_path=
     pickle.dump(filenames, open(paths_path, "wb"))
     print(f"Saved {len(feature_list)} features to {features_path} and {len(filenames)} paths to {paths_path}")
 
+# Add new catalog images to an existing feature index without re-extracting the old ones
+# (saved back to disk when features_path/paths_path are given)
+def add_images_to_index(new_img_paths, feature_list, filenames, features_path=None, paths_path=None):
+    known = set(filenames)
+    added = 0
+    for file in tqdm([f for f in new_img_paths if f not in known], desc="Extracting new features"):
+        try:
+            feature_list.append(extract_feature(file))
+            filenames.append(file)
+            added += 1
+        except Exception as e:
+            print(f"Skipping {file}: {e}")
+
+    if features_path and paths_path:
+        save_features(feature_list, filenames, features_path, paths_path)
+    print(f"Added {added} new features ({len(filenames)} total)")
+    return feature_list, filenames
+
+# Save features + paths (same format as build_feature_index_from_catalog)
+def save_features(feature_list, filenames, features_path="features.pkl", paths_path="imagefiles.pkl"):
+    pickle.dump(feature_list, open(features_path, "wb"))
+    pickle.dump(filenames, open(paths_path, "wb"))
+
 # Load precomputed features
 def load_features(features_path="features.pkl", paths_path="imagefiles.pkl"):
     feature_list = pickle.load(open(features_path, "rb"))
@@ -72,16 +99,166 @@ def load_features(features_path="features.pkl", paths_path="imagefiles.pkl"):
     return feature_list, filenames
 
 # Find similar images
-def recommend_similar_images(query_img_path, feature_list, filenames, top_k=10):
+def recommend_similar_images(query_img_path, feature_list, filenames, top_k=10, item_filter=None):
     query_vector = extract_feature(query_img_path)
+    return recommend_similar_vector(query_vector, feature_list, filenames, top_k=top_k,
+                                    exclude=query_img_path, item_filter=item_filter)
+
+# Find similar images for an already extracted (normalized) query vector
+def recommend_similar_vector(query_vector, feature_list, filenames, top_k=10, exclude=None, item_filter=None):
     similarities = [np.dot(query_vector, feat) for feat in feature_list]
 
     # Get indices sorted by similarity
     indices = np.argsort(similarities)[::-1]
 
+    # Keep only items passing the filter (item_filters.filter_mask)
+    if item_filter is not None:
+        allowed = allowed_mask(item_filter, filenames)
+        indices = indices[allowed[indices]]
+
     # Exclude the query image itself (exact path match)
-    filtered = [(filenames[i], similarities[i]) for i in indices if os.path.abspath(filenames[i]) != os.path.abspath(query_img_path)]
+    if exclude is not None:
+        exclude = os.path.abspath(exclude)
+    filtered = [(filenames[i], similarities[i]) for i in indices if os.path.abspath(filenames[i]) != exclude]
 
     # Take top_k from the filtered list
     return filtered[:top_k]
 
+
+
+# --- Compressed index: PCA reduction + float16/int8 quantization ---
+# python -c "from visual_recommender import *; f, p = load_features(); save_compressed_index(build_compressed_index(f, p))"
+
+# Fit PCA on the full-precision features and store the projected vectors as float16 or int8
+# (int8 keeps one float32 scale per vector). Projected vectors are re-normalized so dot = cosine.
+def build_compressed_index(feature_list, filenames, n_components=256, dtype="int8", random_state=42):
+    if dtype not in ("float16", "int8"):
+        raise ValueError(f"Unsupported dtype {dtype!r}, use 'float16' or 'int8'.")
+    features = np.asarray(feature_list, dtype=np.float32)
+    n_components = min(n_components, features.shape[0], features.shape[1])
+    pca = PCA(n_components=n_components, random_state=random_state).fit(features)
+
+    index = {
+        "mean": pca.mean_.astype(np.float32),
+        "components": pca.components_.astype(np.float32),
+        "dtype": dtype,
+    }
+    index["codes"], index["scales"] = _quantize(features, index)
+    index["filenames"] = list(filenames)
+    return index
+
+# Project full-precision vectors with the stored PCA and quantize them
+def _quantize(features, index):
+    reduced = (features - index["mean"]) @ index["components"].T
+    reduced /= np.maximum(norm(reduced, axis=1, keepdims=True), 1e-12)
+
+    if index["dtype"] == "int8":
+        scales = (np.maximum(np.abs(reduced).max(axis=1), 1e-12) / 127.0).astype(np.float32)
+        return np.round(reduced / scales[:, None]).astype(np.int8), scales
+    return reduced.astype(np.float16), None
+
+# Append new vectors to a compressed index with the frozen PCA projection (no refit)
+def add_to_compressed_index(index, new_features, new_filenames):
+    if len(new_filenames) == 0:
+        return index
+    codes, scales = _quantize(np.asarray(new_features, dtype=np.float32), index)
+    index["codes"] = np.concatenate([index["codes"], codes])
+    if scales is not None:
+        index["scales"] = np.concatenate([index["scales"], scales])
+    index["filenames"] = index["filenames"] + list(new_filenames)
+    return index
+
+def save_compressed_index(index, index_path="features_compressed.pkl"):
+    pickle.dump(index, open(index_path, "wb"))
+    print(f"Saved {len(index['filenames'])} {index['dtype']} vectors "
+          f"({index['codes'].shape[1]} dims) to {index_path}")
+
+def load_compressed_index(index_path="features_compressed.pkl"):
+    return pickle.load(open(index_path, "rb"))
+
+# Project a full-precision query into the compressed space
+def project_query(query_vector, index):
+    reduced = (np.asarray(query_vector, dtype=np.float32) - index["mean"]) @ index["components"].T
+    return reduced / max(norm(reduced), 1e-12)
+
+# Approximate similarities of a projected query against all compressed vectors,
+# dequantized chunk by chunk so the float32 copy never covers the whole catalog
+def compressed_similarities(query_reduced, index, chunk_size=65536):
+    codes, scales = index["codes"], index["scales"]
+    similarities = np.empty(codes.shape[0], dtype=np.float32)
+    for start in range(0, codes.shape[0], chunk_size):
+        block = codes[start:start + chunk_size].astype(np.float32) @ query_reduced
+        if scales is not None:
+            block *= scales[start:start + chunk_size]
+        similarities[start:start + chunk_size] = block
+    return similarities
+
+# Find similar images on the compressed index.
+# With feature_list given, the top `rerank` candidates are re-scored with the exact full-precision vectors.
+def search_compressed(query_vector, index, top_k=10, feature_list=None, rerank=100, exclude=None, item_filter=None):
+    filenames = index["filenames"]
+    similarities = compressed_similarities(project_query(query_vector, index), index)
+    if item_filter is not None:
+        similarities[~allowed_mask(item_filter, filenames)] = -np.inf
+
+    # Over-fetch by one so the query image itself can be dropped from the candidates
+    n_candidates = min(max(top_k, rerank if feature_list is not None else top_k) + 1, len(filenames))
+    if n_candidates <= 0:
+        return []
+    candidates = np.argpartition(-similarities, n_candidates - 1)[:n_candidates]
+    if exclude is not None:
+        exclude = os.path.abspath(exclude)
+        candidates = np.array([i for i in candidates if os.path.abspath(filenames[i]) != exclude], dtype=int)
+    candidates = candidates[np.isfinite(similarities[candidates])]
+
+    if feature_list is not None:
+        scores = np.array([np.dot(query_vector, feature_list[i]) for i in candidates], dtype=np.float32)
+    else:
+        scores = similarities[candidates]
+
+    order = np.argsort(-scores)[:top_k]
+    return [(filenames[candidates[i]], scores[i]) for i in order]
+
+def recommend_similar_images_compressed(query_img_path, index, top_k=10, feature_list=None, rerank=100,
+                                        item_filter=None):
+    query_vector = extract_feature(query_img_path)
+    return search_compressed(query_vector, index, top_k=top_k, feature_list=feature_list,
+                             rerank=rerank, exclude=query_img_path, item_filter=item_filter)
+
+# Recall of the compressed search against exact full-precision search, plus footprint and latency
+def compression_report(feature_list, index, n_queries=100, top_k=10, rerank=100, random_state=42):
+    features = np.asarray(feature_list, dtype=np.float32)
+    rng = np.random.default_rng(random_state)
+    queries = rng.choice(len(features), size=min(n_queries, len(features)), replace=False)
+
+    position = {f: i for i, f in enumerate(index["filenames"])}
+    recalls = {"compressed": [], "reranked": []}
+    timings = {"exact": 0.0, "compressed": 0.0, "reranked": 0.0}
+    for q in queries:
+        start = time.perf_counter()
+        exact_sims = features @ features[q]
+        exact_sims[q] = -np.inf
+        truth = set(np.argpartition(-exact_sims, top_k - 1)[:top_k])
+        timings["exact"] += time.perf_counter() - start
+
+        for mode, feats in (("compressed", None), ("reranked", feature_list)):
+            start = time.perf_counter()
+            found = search_compressed(features[q], index, top_k=top_k, feature_list=feats,
+                                      rerank=rerank, exclude=index["filenames"][q])
+            timings[mode] += time.perf_counter() - start
+            recalls[mode].append(len(truth & {position[f] for f, _ in found}) / top_k)
+
+    bytes_full = features.shape[1] * 4
+    bytes_compressed = index["codes"].shape[1] * index["codes"].itemsize + (4 if index["scales"] is not None else 0)
+    report = {
+        "dims": index["codes"].shape[1],
+        "dtype": index["dtype"],
+        "bytes_per_vector_full": bytes_full,
+        "bytes_per_vector_compressed": bytes_compressed,
+        "compression_ratio": bytes_full / bytes_compressed,
+        f"recall@{top_k}_compressed": float(np.mean(recalls["compressed"])),
+        f"recall@{top_k}_reranked": float(np.mean(recalls["reranked"])),
+    }
+    for mode, total in timings.items():
+        report[f"latency_ms_{mode}"] = total / len(queries) * 1000
+    return report